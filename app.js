@@ -1,5 +1,6 @@
 // Configuration
 const BACKEND_URL = 'https://youtube-video-downloader-jgz9.onrender.com'; // Your Flask backend URL
+const JOB_POLL_INTERVAL_MS = 1000; // How often to poll a queued format job
 
 // DOM Elements Cache
 const elements = {
@@ -246,6 +247,17 @@ function filterFormats() {
 }
 
 // --- Core Logic Functions ---
+// Requests formats; when the server queues the lookup (202 + jobId), polls until the job finishes.
+async function requestFormats(url) {
+    let response = await fetch(`${BACKEND_URL}/api/get-formats?url=${encodeURIComponent(url)}`);
+    while (response.status === 202) {
+        const { jobId } = await response.json();
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        response = await fetch(`${BACKEND_URL}/api/job/${encodeURIComponent(jobId)}`);
+    }
+    return response;
+}
+
 async function fetchVideoInfo() {
     const url = elements.urlInput.value.trim();
     if (!isValidUrl(url)) { elements.urlError.classList.remove('hidden'); return; }
@@ -254,8 +266,7 @@ async function fetchVideoInfo() {
     currentState.videoId = extractVideoId(url); // Attempt to extract Video ID
     showLoading();
     try {
-        const apiUrl = `${BACKEND_URL}/api/get-formats?url=${encodeURIComponent(url)}`;
-        const response = await fetch(apiUrl);
+        const response = await requestFormats(url);
         if (!response.ok) { let eMsg='Failed fetch.'; try { const eData=await response.json(); eMsg=eData.error||`Server Error (${response.status})`; } catch(e){eMsg=`Server Error (${response.status})`;} throw new Error(eMsg); }
         const data = await response.json(); if (!data.success) { throw new Error(data.error || 'Backend error.'); }
         // Update UI
@@ -1,19 +1,31 @@
 # --- Required Imports ---
-import json
 from flask import (
-    Flask, request, jsonify, Response,
-    send_file, abort, after_this_request,
-    send_from_directory
+    Flask, request, Response,
+    send_file, after_this_request
 )
 from flask_cors import CORS
 import yt_dlp
+import orjson
 import logging
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs, quote
 import os
 import tempfile
 import shutil
-import glob
+import threading
+import time
+import queue
+from contextlib import contextmanager
+import hashlib
+import gzip
+import mimetypes
+from operator import itemgetter
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import sys
+import unicodedata
+from cachetools import TTLCache
 
 # --- Basic Configuration ---
 logging.basicConfig(level=logging.INFO)
@@ -26,6 +38,63 @@ SUPPORTED_DOMAINS = [
     'youtube.com', 'www.youtube.com', 'm.youtube.com',
     'youtu.be', 'youtube-nocookie.com', 'www.youtube-nocookie.com'
 ]
+SUPPORTED_DOMAIN_SET = frozenset(SUPPORTED_DOMAINS)
+SUPPORTED_DOMAIN_SUFFIXES = tuple('.' + domain for domain in SUPPORTED_DOMAIN_SET)
+# Common URL forms accepted without parsing; the trailing '/' pins the host
+SUPPORTED_URL_PREFIXES = tuple(
+    f"{scheme}://{domain}/" for scheme in ('https', 'http') for domain in SUPPORTED_DOMAINS
+)
+
+INVALID_FILENAME_CHARS = str.maketrans('', '', '\\/*?:"<>|')
+FILENAME_WHITESPACE_RE = re.compile(r'[\s_]+')
+
+STATIC_MAX_AGE = 3600
+STREAM_CHUNK_SIZE = 1024 * 1024
+# yt-dlp already merges with ffmpeg '-c copy' (no re-encode). Matroska is kept because
+# merges stream to stdout, where yt-dlp would write an '.mp4' as MPEG-TS, and it holds
+# every codec pairing YouTube serves (VP9/AV1/H.264 with Opus/AAC).
+MERGE_OUTPUT_FORMAT = 'mkv'
+
+# Parallel-connection downloader for file-based downloads; None falls back to yt-dlp's own
+ARIA2C_PATH = shutil.which('aria2c')
+ARIA2C_ARGS = ['-x', '16', '-s', '16', '-k', '1M', '--min-split-size=1M', '--file-allocation=none']
+
+# --- Metadata Cache ---
+# Keyed by canonical video ID; holds (info, video_formats, audio_formats, best_audio, formats_by_id).
+INFO_CACHE = TTLCache(maxsize=1024, ttl=600)
+INFO_CACHE_LOCK = threading.Lock()
+VIDEO_ID_PATH_PREFIXES = ('shorts', 'embed', 'live', 'v')
+
+# --- Response Compression ---
+JSON_COMPRESS_MIN_SIZE = 1024
+JSON_COMPRESS_LEVEL = 5
+
+# --- Background Jobs ---
+# Format extraction runs here so request threads are not held during yt-dlp network I/O.
+# JOBS (like INFO_CACHE) lives in this process's memory, so the app must run as a single
+# process: with several workers a poll can land on one that never saw the job and get a 404.
+# Scale with threads or gevent connections, not worker processes.
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='ytdl-job')
+JOBS = TTLCache(maxsize=1024, ttl=600)  # job_id -> (future, submitted_at)
+JOB_TIMEOUT = 45
+JOBS_LOCK = threading.Lock()
+
+# --- yt-dlp Instance Pool ---
+# Idle info-extraction YoutubeDL instances, reused so extractor setup isn't repeated per request.
+YDL_POOL_SIZE = 8
+INFO_YDL_POOL = queue.Queue(maxsize=YDL_POOL_SIZE)
+
+# --- Temporary Storage ---
+# Range-request downloads are written to tmpfs when it is available and has room.
+TMPFS_DIR = '/dev/shm'
+TMPFS_MIN_FREE_BYTES = 2 * 1024 * 1024 * 1024
+
+# --- Reverse Proxy Configuration ---
+# When set (e.g. '/internal-tmp/'), finished files are handed to Nginx via X-Accel-Redirect.
+# The Nginx location must be 'internal' and alias the system temp directory.
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+# Seconds to keep the file after responding; once Nginx has opened it, deletion is safe on POSIX.
+X_ACCEL_CLEANUP_DELAY = int(os.environ.get('X_ACCEL_CLEANUP_DELAY', 60))
 
 # --- YouTube Configuration ---
 COOKIES_FILE = 'cookies.txt' if os.path.exists('cookies.txt') else None
@@ -36,23 +105,49 @@ DEFAULT_HEADERS = {
 }
 
 # --- Helper Functions ---
+def ojsonify(obj, status=200):
+    """Serialize obj with orjson into a JSON response."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def normalize_url(url):
+    """Prefix a scheme-less URL with https://."""
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url
+
 def is_supported_url(url):
-    """Check if the URL is from a supported domain."""
+    """Check if a normalized (scheme-prefixed) URL is from a supported domain."""
     if not url: return False
+    if url.startswith(SUPPORTED_URL_PREFIXES): return True
     try:
-        if not url.startswith(('http://', 'https://')):
-            url = 'https://' + url
         domain = urlparse(url).netloc.lower()
-        return any(domain == supported or ('.' in supported and domain.endswith('.' + supported))
-                   for supported in SUPPORTED_DOMAINS)
+        return domain in SUPPORTED_DOMAIN_SET or domain.endswith(SUPPORTED_DOMAIN_SUFFIXES)
     except Exception as e:
         logger.error(f"URL parsing/validation error for '{url}': {e}")
         return False
 
+def extract_video_id(url):
+    """Return the canonical YouTube video ID for a URL, or None if not found."""
+    parsed = urlparse(url)
+    domain = parsed.netloc.lower()
+    path_parts = [part for part in parsed.path.split('/') if part]
+    if domain == 'youtu.be' or domain.endswith('.youtu.be'):
+        return path_parts[0] if path_parts else None
+    video_id = parse_qs(parsed.query).get('v', [None])[0]
+    if video_id:
+        return video_id
+    if len(path_parts) >= 2 and path_parts[0] in VIDEO_ID_PATH_PREFIXES:
+        return path_parts[1]
+    return None
+
+def get_cache_key(url):
+    """Cache key for a URL: its video ID when parseable, else the URL itself."""
+    return extract_video_id(url) or url
+
 def sanitize_filename(filename):
     """Sanitize the filename to remove invalid characters and limit length."""
-    sanitized = re.sub(r'[\\/*?:"<>|]', "", filename)
-    sanitized = re.sub(r'[\s_]+', '_', sanitized)
+    sanitized = filename.translate(INVALID_FILENAME_CHARS)
+    sanitized = FILENAME_WHITESPACE_RE.sub('_', sanitized)
     sanitized = sanitized.strip('_ ')
     sanitized = sanitized[:150]
     if not sanitized: return "downloaded_video"
@@ -77,86 +172,232 @@ def get_ydl_options(request_type='info'):
     
     if request_type == 'download':
         base_options.update({
-            'merge_output_format': 'mkv',
+            'merge_output_format': MERGE_OUTPUT_FORMAT,
             'socket_timeout': 60,
             'retries': 3,
             'fragment_retries': 3,
             'skip_unavailable_fragments': True
         })
+        if ARIA2C_PATH:
+            base_options['external_downloader'] = {'default': ARIA2C_PATH}
+            base_options['external_downloader_args'] = {'aria2c': ARIA2C_ARGS}
     else:
-        base_options['skip_download'] = True
+        # Metadata only: skip manifests, subtitles and comments the format list never uses
+        base_options.update({
+            'skip_download': True,
+            'socket_timeout': 30,
+            'writesubtitles': False,
+            'writeautomaticsub': False,
+            'getcomments': False
+        })
+        youtube_args = base_options['extractor_args']['youtube']
+        youtube_args['player_skip'] = ['webpage', 'configs']
+        youtube_args['skip'] = ['dash', 'hls', 'translated_subs']
     
     if COOKIES_FILE:
         base_options['cookiefile'] = COOKIES_FILE
     
     return base_options
 
+@contextmanager
+def pooled_info_ydl():
+    """Borrow an info-extraction YoutubeDL from the pool, creating one if none is idle."""
+    try:
+        ydl = INFO_YDL_POOL.get_nowait()
+    except queue.Empty:
+        ydl = yt_dlp.YoutubeDL(get_ydl_options('info'))
+    try:
+        yield ydl
+    finally:
+        try:
+            INFO_YDL_POOL.put_nowait(ydl)
+        except queue.Full:
+            ydl.close()
+
+def get_ytdlp_command(video_url, format_selector, merge_output_format=None):
+    """Build a yt-dlp CLI invocation that writes the download to stdout."""
+    command = [
+        sys.executable, '-m', 'yt_dlp',
+        '--no-playlist', '--quiet', '--no-warnings',
+        '--extractor-args', 'youtube:player_client=android;player_skip=webpage',
+        '--socket-timeout', '60',
+        '--retries', '3',
+        '--fragment-retries', '3',
+        '--skip-unavailable-fragments',
+        '--format', format_selector,
+        '--output', '-'
+    ]
+    for header, value in DEFAULT_HEADERS.items():
+        command += ['--add-header', f'{header}:{value}']
+    if merge_output_format:
+        command += ['--merge-output-format', merge_output_format]
+    if COOKIES_FILE:
+        command += ['--cookies', COOKIES_FILE]
+    command += ['--', video_url]
+    return command
+
+def content_disposition(filename):
+    """Build an attachment Content-Disposition header value, RFC 5987-encoding non-ASCII names."""
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename)}"
+    return f'attachment; filename="{filename}"'
+
+def read_stderr_log(stderr_file):
+    """Return the text yt-dlp wrote to its stderr temp file."""
+    stderr_file.seek(0)
+    return stderr_file.read().decode('utf-8', 'replace').strip()
+
+def stream_download(video_url, format_selector, final_filename, merge_output_format=None):
+    """Pipe yt-dlp's stdout (ffmpeg's output when merging) straight to the client."""
+    # stderr goes to a file so unread error output can never fill a pipe and stall stdout
+    stderr_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        get_ytdlp_command(video_url, format_selector, merge_output_format),
+        stdout=subprocess.PIPE,
+        stderr=stderr_file,
+        bufsize=1 << 20
+    )
+
+    # Wait for the first bytes so extraction errors can still be reported as JSON.
+    # read1() returns whatever is buffered instead of blocking until a full chunk arrives.
+    first_chunk = proc.stdout.read1(STREAM_CHUNK_SIZE)
+    if not first_chunk:
+        proc.stdout.close()
+        proc.wait()
+        stderr_output = read_stderr_log(stderr_file)
+        stderr_file.close()
+        raise yt_dlp.utils.DownloadError(stderr_output or "yt-dlp produced no output.")
+
+    def generate():
+        try:
+            yield first_chunk
+            for chunk in iter(lambda: proc.stdout.read1(STREAM_CHUNK_SIZE), b''):
+                yield chunk
+            # Raising here makes the WSGI server abort the connection instead of
+            # ending the response cleanly, so a truncated file doesn't look complete.
+            return_code = proc.wait()
+            if return_code != 0:
+                stderr_output = read_stderr_log(stderr_file)
+                logger.error("API: yt-dlp exited with %s mid-stream: %s", return_code, stderr_output)
+                raise yt_dlp.utils.DownloadError(stderr_output or f"yt-dlp exited with status {return_code}.")
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            stderr_file.close()
+
+    return Response(
+        generate(),
+        mimetype='application/octet-stream',
+        headers={
+            'Content-Disposition': content_disposition(final_filename),
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def get_temp_root():
+    """Return TMPFS_DIR if it is usable and has TMPFS_MIN_FREE_BYTES free, else None (system default)."""
+    # Nginx aliases a fixed directory, so X-Accel-Redirect downloads stay in the system temp dir
+    if X_ACCEL_REDIRECT_PREFIX:
+        return None
+    if not (os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK)):
+        return None
+    try:
+        if shutil.disk_usage(TMPFS_DIR).free < TMPFS_MIN_FREE_BYTES:
+            return None
+    except OSError:
+        return None
+    return TMPFS_DIR
+
+def schedule_cleanup(temp_dir_path, delay):
+    """Remove a temporary directory after a delay, on a background timer thread."""
+    timer = threading.Timer(delay, shutil.rmtree, args=[temp_dir_path], kwargs={'ignore_errors': True})
+    timer.daemon = True
+    timer.start()
+
 def extract_formats(info_dict):
     """Extracts and processes video and audio format information."""
     formats = info_dict.get('formats', [])
-    video_formats = []
-    audio_formats = []
-    best_audio_info = None
+    # (sort_key, format_dict) pairs; keys are computed once while building
+    video_entries = []
+    audio_entries = []
 
     for f in formats:
-        if not f.get('url') or not f.get('format_id') or f.get('is_live'):
+        g = f.get
+        url = g('url')
+        format_id = g('format_id')
+        if not url or not format_id or g('is_live'):
             continue
 
-        filesize = f.get('filesize') or f.get('filesize_approx')
+        vcodec = g('vcodec')
+        acodec = g('acodec')
+        ext = g('ext')
+        protocol = g('protocol')
+        format_note = g('format_note')
+        filesize = g('filesize') or g('filesize_approx')
         size_mb = f"{filesize / (1024 * 1024):.2f} MB" if filesize else "N/A"
-        current_abr = f.get('abr')
-        quality_note = f.get('format_note', f.get('resolution'))
 
         # Video Format Processing
-        if f.get('vcodec') != 'none' and (f.get('resolution') or f.get('height')):
-            height = int(f.get('height', 0)) if str(f.get('height', '0')).isdigit() else 0
-            quality_label = f.get('format_note', f.get('resolution', 'Unknown Video'))
-            
-            video_formats.append({
-                "quality": quality_label,
-                "resolution": f.get('resolution'),
+        if vcodec != 'none':
+            resolution = g('resolution')
+            raw_height = g('height')
+            if not (resolution or raw_height):
+                continue
+            height = int(raw_height) if str(raw_height).isdigit() else 0
+            fps = g('fps')
+
+            video_sort_key = (-height, -(fps or 0))
+            video_entries.append((video_sort_key, {
+                "quality": format_note or resolution or 'Unknown Video',
+                "resolution": resolution,
                 "size": size_mb,
-                "id": f['format_id'],
-                "vcodec": f.get('vcodec'),
-                "acodec": f.get('acodec'),
-                "ext": f.get('ext', 'mp4'),
-                "url": f.get('url'),
+                "id": format_id,
+                "vcodec": vcodec,
+                "acodec": acodec,
+                "ext": ext or 'mp4',
+                "url": url,
                 "height": height,
-                "fps": f.get('fps'),
-                "protocol": f.get('protocol'),
+                "fps": fps,
+                "protocol": protocol,
                 "filesize": filesize
-            })
+            }))
 
         # Audio Format Processing
-        elif f.get('acodec') != 'none' and f.get('vcodec') == 'none':
-            quality_label = f.get('format_note')
-            if not quality_label and isinstance(current_abr, (int, float)):
+        elif acodec != 'none':
+            current_abr = g('abr')
+            is_numeric_abr = isinstance(current_abr, (int, float))
+            quality_label = format_note
+            if not quality_label and is_numeric_abr:
                 quality_label = f"~{current_abr:.0f}kbps"
             elif not quality_label:
-                quality_label = f"Audio ({f.get('acodec', '?')})"
+                quality_label = f"Audio ({acodec or '?'})"
 
             audio_format_dict = {
                 "quality": quality_label,
                 "abr": current_abr,
                 "size": size_mb,
                 "filesize": filesize,
-                "id": f['format_id'],
-                "acodec": f.get('acodec'),
-                "ext": f.get('ext', 'm4a'),
-                "url": f.get('url'),
-                "protocol": f.get('protocol')
+                "id": format_id,
+                "acodec": acodec,
+                "ext": ext or 'm4a',
+                "url": url,
+                "protocol": protocol
             }
-            audio_formats.append(audio_format_dict)
+            audio_sort_key = -current_abr if is_numeric_abr else 1
+            audio_entries.append((audio_sort_key, audio_format_dict))
 
-            if isinstance(current_abr, (int, float)):
-                if best_audio_info is None or current_abr > best_audio_info.get('abr', -1):
-                    best_audio_info = audio_format_dict
-            elif best_audio_info is None:
-                best_audio_info = audio_format_dict
+    # Sorting (highest resolution/fps and bitrate first)
+    video_entries.sort(key=itemgetter(0))
+    audio_entries.sort(key=itemgetter(0))
+    video_formats = [entry[1] for entry in video_entries]
+    audio_formats = [entry[1] for entry in audio_entries]
 
-    # Sorting
-    video_formats.sort(key=lambda x: (-x['height'], -(x.get('fps') or 0)))
-    audio_formats.sort(key=lambda x: -(x.get('abr') if isinstance(x.get('abr'), (int, float)) else -1))
+    # Sorted by descending bitrate, so the head is the best audio stream
+    best_audio_info = audio_formats[0] if audio_formats else None
 
     final_audio_summary = None
     if best_audio_info:
@@ -169,65 +410,96 @@ def extract_formats(info_dict):
 
     return video_formats, audio_formats, final_audio_summary
 
-# --- Static File Serving ---
-@app.route('/')
-def serve_index():
-    return send_from_directory('.', 'index.html')
-
-@app.route('/app.js')
-def serve_js():
-    return send_from_directory('.', 'app.js')
-
-@app.route('/style.css')
-def serve_css():
-    return send_from_directory('.', 'style.css')
+def build_format_index(info_dict):
+    """Map format_id to the fields /api/download needs to plan a download or merge."""
+    return {
+        f['format_id']: {
+            "format_id": f['format_id'],
+            "vcodec": f.get('vcodec'),
+            "acodec": f.get('acodec'),
+            "ext": f.get('ext'),
+            "height": f.get('height'),
+            "protocol": f.get('protocol')
+        }
+        for f in info_dict.get('formats', []) if f.get('format_id')
+    }
 
-# --- API Endpoints ---
-@app.route('/api/get-formats', methods=['GET'])
-def get_formats():
-    """API endpoint to fetch video information and available formats."""
-    video_url = request.args.get('url')
-    if not video_url: return jsonify({"success": False, "error": "Missing 'url' parameter"}), 400
-    if not video_url.startswith(('http://', 'https://')):
-        video_url = 'https://' + video_url
-    if not is_supported_url(video_url):
-        return jsonify({"success": False, "error": "Invalid or unsupported URL."}), 400
+def build_cache_entry(info_dict):
+    """Trim an info_dict down to the fields returned by /api/get-formats."""
+    video_formats, audio_formats, best_audio_summary = extract_formats(info_dict)
+    info = {
+        "title": info_dict.get('title', 'Untitled Video'),
+        "thumbnail": info_dict.get('thumbnail') or '',
+        "duration": info_dict.get('duration'),
+        "uploader": info_dict.get('uploader', 'Unknown'),
+        "view_count": info_dict.get('view_count')
+    }
+    return info, video_formats, audio_formats, best_audio_summary, build_format_index(info_dict)
+
+def find_progressive_format(formats_by_id, min_height):
+    """Return the lowest progressive (video+audio) HTTP format at least min_height tall, or None."""
+    candidates = [
+        f for f in formats_by_id.values()
+        if f['vcodec'] not in (None, 'none') and f['acodec'] not in (None, 'none')
+        and isinstance(f['height'], int) and f['height'] >= min_height
+        and f['protocol'] in ('http', 'https')
+    ]
+    return min(candidates, key=itemgetter('height'), default=None)
+
+def get_cached_entry(cache_key):
+    """Return the cache entry for a key, or None on a miss."""
+    with INFO_CACHE_LOCK:
+        return INFO_CACHE.get(cache_key)
+
+def cached_extract(video_url, refresh=False):
+    """Return the cache entry for a URL, running yt-dlp only on a miss or when refresh is set."""
+    cache_key = get_cache_key(video_url)
+    if not refresh:
+        entry = get_cached_entry(cache_key)
+        if entry:
+            return entry
 
     logger.info(f"API: Fetching formats for URL: {video_url}")
-    
+    with pooled_info_ydl() as ydl:
+        info_dict = ydl.extract_info(video_url, download=False)
+    if not info_dict:
+        raise yt_dlp.utils.DownloadError("No video information extracted.")
+
+    entry = build_cache_entry(info_dict)
+    _, video_formats, audio_formats, _, _ = entry
+    if not video_formats and not audio_formats:
+        if info_dict.get('is_live'):
+            raise yt_dlp.utils.DownloadError("Live streams cannot be downloaded until finished.")
+        raise yt_dlp.utils.DownloadError("No downloadable video or audio formats found.")
+
+    with INFO_CACHE_LOCK:
+        INFO_CACHE[cache_key] = entry
+    return entry
+
+def format_payload(entry, warning=None):
+    """Build the /api/get-formats JSON payload from a cache entry."""
+    info, video_formats, audio_formats, best_audio_summary, _ = entry
+    payload = {
+        "success": True,
+        "videoTitle": info["title"],
+        "thumbnailUrl": info["thumbnail"],
+        "duration": info["duration"],
+        "uploader": info["uploader"],
+        "viewCount": info["view_count"],
+        "formats": {
+            "video": video_formats,
+            "audio": audio_formats,
+            "bestAudio": best_audio_summary
+        }
+    }
+    if warning:
+        payload["warning"] = warning
+    return payload
+
+def fetch_formats(video_url, refresh=False):
+    """Extract formats with yt-dlp and cache them. Runs on JOB_EXECUTOR; returns (payload, status_code)."""
     try:
-        with yt_dlp.YoutubeDL(get_ydl_options('info')) as ydl:
-            info_dict = ydl.extract_info(video_url, download=False)
-            if not info_dict:
-                raise yt_dlp.utils.DownloadError("No video information extracted.")
-
-            video_title = info_dict.get('title', 'Untitled Video')
-            thumbnails = info_dict.get('thumbnails', [])
-            thumbnail_url = thumbnails[-1]['url'] if thumbnails else info_dict.get('thumbnail', '')
-            duration = info_dict.get('duration')
-            uploader = info_dict.get('uploader', 'Unknown')
-            view_count = info_dict.get('view_count')
-
-            video_formats, audio_formats, best_audio_summary = extract_formats(info_dict)
-
-            if not video_formats and not audio_formats:
-                if info_dict.get('is_live'):
-                    raise yt_dlp.utils.DownloadError("Live streams cannot be downloaded until finished.")
-                raise yt_dlp.utils.DownloadError("No downloadable video or audio formats found.")
-
-            return jsonify({
-                "success": True,
-                "videoTitle": video_title,
-                "thumbnailUrl": thumbnail_url,
-                "duration": duration,
-                "uploader": uploader,
-                "viewCount": view_count,
-                "formats": {
-                    "video": video_formats,
-                    "audio": audio_formats,
-                    "bestAudio": best_audio_summary
-                }
-            })
+        return format_payload(cached_extract(video_url, refresh)), 200
 
     except yt_dlp.utils.DownloadError as e:
         error_message = str(e)
@@ -242,21 +514,10 @@ def get_formats():
                 with yt_dlp.YoutubeDL(retry_options) as ydl:
                     info_dict = ydl.extract_info(video_url, download=False)
                     if info_dict:
-                        video_formats, audio_formats, best_audio_summary = extract_formats(info_dict)
-                        return jsonify({
-                            "success": True,
-                            "videoTitle": info_dict.get('title', 'Untitled Video'),
-                            "thumbnailUrl": info_dict.get('thumbnail', ''),
-                            "duration": info_dict.get('duration'),
-                            "uploader": info_dict.get('uploader', 'Unknown'),
-                            "viewCount": info_dict.get('view_count'),
-                            "formats": {
-                                "video": video_formats,
-                                "audio": audio_formats,
-                                "bestAudio": best_audio_summary
-                            },
-                            "warning": "Used fallback method to retrieve formats"
-                        })
+                        entry = build_cache_entry(info_dict)
+                        with INFO_CACHE_LOCK:
+                            INFO_CACHE[get_cache_key(video_url)] = entry
+                        return format_payload(entry, warning="Used fallback method to retrieve formats"), 200
             except Exception as retry_error:
                 error_message = "YouTube requires bot verification. Cannot download automatically."
         
@@ -268,11 +529,106 @@ def get_formats():
         elif "Premiere" in error_message or "live event" in error_message: error_message = "Livestreams/Premieres cannot be downloaded until finished."
         elif "429" in error_message or "Too Many Requests" in error_message: error_message = "Rate limited by YouTube. Please wait and try again later."
         
-        return jsonify({"success": False, "error": error_message}), 400
+        return {"success": False, "error": error_message}, 400
 
     except Exception as e:
         logger.exception(f"API: Unexpected server error processing URL {video_url}: {e}")
-        return jsonify({"success": False, "error": "An unexpected server error occurred while fetching formats."}), 500
+        return {"success": False, "error": "An unexpected server error occurred while fetching formats."}, 500
+
+# --- Response Hooks ---
+@app.after_request
+def compress_json_response(response):
+    """Gzip JSON bodies of at least JSON_COMPRESS_MIN_SIZE bytes for clients that accept it."""
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < JSON_COMPRESS_MIN_SIZE:
+        return response
+    # The body depends on Accept-Encoding whether or not this client gets gzip
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip'] > 0:
+        response.set_data(gzip.compress(data, JSON_COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# --- Static File Serving ---
+# The frontend is read into memory once at startup; restart the process to pick up changes.
+def load_static_file(name):
+    """Read a frontend file and return (data, etag, mimetype)."""
+    with open(os.path.join(app.root_path, name), 'rb') as static_file:
+        data = static_file.read()
+    return data, hashlib.sha256(data).hexdigest(), mimetypes.guess_type(name)[0]
+
+STATIC_FILES = {name: load_static_file(name) for name in ('index.html', 'app.js', 'style.css')}
+
+def serve_static(name):
+    """Serve a preloaded frontend file, answering If-None-Match with 304."""
+    data, etag, mimetype = STATIC_FILES[name]
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = STATIC_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/')
+def serve_index():
+    return serve_static('index.html')
+
+@app.route('/app.js')
+def serve_js():
+    return serve_static('app.js')
+
+@app.route('/style.css')
+def serve_css():
+    return serve_static('style.css')
+
+# --- API Endpoints ---
+@app.route('/api/get-formats', methods=['GET'])
+def get_formats():
+    """API endpoint to fetch video information and available formats."""
+    video_url = request.args.get('url')
+    if not video_url: return ojsonify({"success": False, "error": "Missing 'url' parameter"}, 400)
+    video_url = normalize_url(video_url)
+    if not is_supported_url(video_url):
+        return ojsonify({"success": False, "error": "Invalid or unsupported URL."}, 400)
+
+    refresh = request.args.get('refresh') == '1'
+    if not refresh:
+        cached_entry = get_cached_entry(get_cache_key(video_url))
+        if cached_entry:
+            logger.debug("API: Serving cached formats for: %s", video_url)
+            return ojsonify(format_payload(cached_entry))
+
+    job_id = uuid.uuid4().hex
+    future = JOB_EXECUTOR.submit(fetch_formats, video_url, refresh)
+    with JOBS_LOCK:
+        JOBS[job_id] = (future, time.monotonic())
+    logger.info("API: Queued format job %s for URL: %s", job_id, video_url)
+    return ojsonify({"success": True, "status": "pending", "jobId": job_id}, 202)
+
+@app.route('/api/job/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """API endpoint to poll a queued format job."""
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if job is None:
+        return ojsonify({"success": False, "error": "Unknown or expired job."}, 404)
+    future, submitted_at = job
+    timed_out = not future.done() and time.monotonic() - submitted_at > JOB_TIMEOUT
+    # A concurrent poll may already have timed the job out and cancelled it
+    if timed_out or future.cancelled():
+        # cancel() only drops a job still waiting in the queue; an extraction that is
+        # already running keeps its pool thread until yt-dlp returns, and its result is discarded.
+        future.cancel()
+        with JOBS_LOCK:
+            JOBS.pop(job_id, None)
+        logger.warning("API: Format job %s timed out after %ss; abandoning it", job_id, JOB_TIMEOUT)
+        return ojsonify({"success": False, "error": "Timed out fetching video information. Please try again."}, 504)
+    if not future.done():
+        return ojsonify({"success": True, "status": "pending", "jobId": job_id}, 202)
+    payload, status_code = future.result()
+    return ojsonify(payload, status_code)
 
 @app.route('/api/download', methods=['GET'])
 def download_video():
@@ -282,31 +638,46 @@ def download_video():
     filename_in = request.args.get('filename', 'video')
 
     if not video_url or not format_id:
-        return jsonify({"success": False, "error": "Missing parameters"}), 400
-    if not video_url.startswith(('http://', 'https://')):
-        video_url = 'https://' + video_url
+        return ojsonify({"success": False, "error": "Missing parameters"}, 400)
+    video_url = normalize_url(video_url)
 
-    logger.info(f"API: Server download request - URL: {video_url}, Format: {format_id}")
+    logger.info("API: Server download request - URL: %s, Format: %s", video_url, format_id)
 
     temp_dir_path = None
     try:
-        temp_dir_path = tempfile.mkdtemp()
-        logger.info(f"API: Created temporary directory: {temp_dir_path}")
-
-        # Get format info with anti-bot options
-        with yt_dlp.YoutubeDL(get_ydl_options('info')) as ydl_info:
-            info_dict = ydl_info.extract_info(video_url, download=False)
-            formats = info_dict.get('formats', [])
-            selected_format = next((f for f in formats if f.get('format_id') == format_id), None)
-            if not selected_format:
-                raise yt_dlp.utils.DownloadError(f"Format ID {format_id} not found.")
+        # Get format info from the metadata cache (shared with /api/get-formats)
+        formats_by_id = cached_extract(video_url)[4]
+        selected_format = formats_by_id.get(format_id)
+        if not selected_format:
+            raise yt_dlp.utils.DownloadError(f"Format ID {format_id} not found.")
 
         needs_audio_merge = selected_format.get('vcodec') != 'none' and selected_format.get('acodec') == 'none'
-        actual_ext = 'mkv' if needs_audio_merge else selected_format.get('ext', 'mp4')
+        actual_ext = MERGE_OUTPUT_FORMAT if needs_audio_merge else selected_format.get('ext') or 'mp4'
         final_format_selector = f"{format_id}+bestaudio/bestaudio" if needs_audio_merge else format_id
 
+        # A progressive format of at least the same height needs no ffmpeg merge
+        if needs_audio_merge and isinstance(selected_format.get('height'), int):
+            progressive_format = find_progressive_format(formats_by_id, selected_format['height'])
+            if progressive_format:
+                logger.debug("API: Using progressive format %s instead of merging %s", progressive_format['format_id'], format_id)
+                needs_audio_merge = False
+                actual_ext = progressive_format.get('ext') or 'mp4'
+                final_format_selector = progressive_format['format_id']
+
         safe_base_filename = sanitize_filename(os.path.splitext(filename_in)[0])
         final_filename = f"{safe_base_filename}.{actual_ext}"
+
+        # Stream straight to the client unless a byte range was requested,
+        # which needs a complete file on disk to seek into.
+        if 'Range' not in request.headers:
+            logger.debug("API: Streaming format %s to client", final_format_selector)
+            return stream_download(
+                video_url, final_format_selector, final_filename,
+                merge_output_format=actual_ext if needs_audio_merge else None
+            )
+
+        temp_dir_path = tempfile.mkdtemp(prefix='ytdl-', dir=get_temp_root())
+        logger.debug("API: Created temporary directory: %s", temp_dir_path)
         temp_output_template = os.path.join(temp_dir_path, f"download_temp.%(ext)s")
 
         download_options = get_ydl_options('download')
@@ -316,23 +687,35 @@ def download_video():
             'merge_output_format': actual_ext if needs_audio_merge else None,
         })
 
-        logger.info(f"API: Starting download with options: {download_options}")
+        logger.debug("API: Starting download with options: %s", download_options)
         with yt_dlp.YoutubeDL(download_options) as ydl_down:
-            ydl_down.download([video_url])
-
-        downloaded_files = glob.glob(os.path.join(temp_dir_path, "download_temp.*"))
-        if not downloaded_files:
-            abort(500, description="Server error: Output file missing after download.")
-        actual_temp_filepath = downloaded_files[0]
-
-        final_filepath = os.path.join(temp_dir_path, final_filename)
-        os.rename(actual_temp_filepath, final_filepath)
+            download_info = ydl_down.extract_info(video_url, download=True)
+            # requested_downloads holds the post-merge path; prepare_filename covers older yt-dlp
+            requested_downloads = download_info.get('requested_downloads') or [{}]
+            final_filepath = requested_downloads[0].get('filepath') or ydl_down.prepare_filename(download_info)
+
+        if X_ACCEL_REDIRECT_PREFIX:
+            # Nginx sends the file with sendfile(2) after this response returns,
+            # so the directory has to outlive the request.
+            relative_path = os.path.relpath(final_filepath, tempfile.gettempdir())
+            response = Response(
+                mimetype='application/octet-stream',
+                headers={
+                    'Content-Disposition': content_disposition(final_filename),
+                    'X-Accel-Redirect': X_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative_path)
+                }
+            )
+            schedule_cleanup(temp_dir_path, X_ACCEL_CLEANUP_DELAY)
+            return response
 
-        response = send_file(
-            final_filepath,
-            as_attachment=True,
-            download_name=final_filename
-        )
+        try:
+            response = send_file(
+                final_filepath,
+                as_attachment=True,
+                download_name=final_filename
+            )
+        except FileNotFoundError:
+            raise yt_dlp.utils.DownloadError("Server error: Output file missing after download.")
         response.headers['X-Accel-Buffering'] = 'no'
 
         @after_this_request
@@ -341,7 +724,7 @@ def download_video():
                 try:
                     shutil.rmtree(temp_dir_path)
                 except Exception as e:
-                    logger.error(f"API: Error during cleanup: {e}")
+                    logger.error("API: Error during cleanup: %s", e)
             return response
 
         return response
@@ -350,20 +733,20 @@ def download_video():
         error_msg = str(e)
         if "Sign in to confirm you're not a bot" in error_msg:
             error_msg = "YouTube requires bot verification. Cannot download automatically."
-        logger.error(f"API: Download failed: {error_msg}")
+        logger.error("API: Download failed: %s", error_msg)
         if temp_dir_path and os.path.exists(temp_dir_path):
             shutil.rmtree(temp_dir_path)
-        return jsonify({"success": False, "error": error_msg}), 500
+        return ojsonify({"success": False, "error": error_msg}, 500)
 
     except Exception as e:
-        logger.exception(f"API: Critical error during download: {e}")
+        logger.exception("API: Critical error during download: %s", e)
         if temp_dir_path and os.path.exists(temp_dir_path):
             shutil.rmtree(temp_dir_path)
-        return jsonify({"success": False, "error": "Server download failed unexpectedly."}), 500
+        return ojsonify({"success": False, "error": "Server download failed unexpectedly."}, 500)
 
 @app.route('/api/health')
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    return ojsonify({"status": "healthy"}, 200)
 
 # --- Run the Flask App ---
 if __name__ == '__main__':